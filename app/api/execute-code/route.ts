@@ -1,4 +1,5 @@
 import { NextRequest, NextResponse } from 'next/server';
+import { postToModal } from '@/lib/modal';
 
 export async function POST(request: NextRequest) {
   try {
@@ -11,15 +12,11 @@ export async function POST(request: NextRequest) {
       );
     }
 
-    // Modal endpoint URL with query parameters
-    const modalEndpointUrl = new URL('https://playground-hackmit--code-executor-execute-code-endpoint.modal.run');
-    modalEndpointUrl.searchParams.append('code', code);
-    modalEndpointUrl.searchParams.append('language', language);
-
     // Call Modal execute_code endpoint
-    const response = await fetch(modalEndpointUrl.toString(), {
-      method: 'POST'
-    });
+    const response = await postToModal(
+      'https://playground-hackmit--code-executor-execute-code-endpoint.modal.run',
+      { code, language }
+    );
 
     if (!response.ok) {
       const errorText = await response.text();
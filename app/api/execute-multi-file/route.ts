@@ -1,9 +1,10 @@
 import { NextRequest, NextResponse } from 'next/server';
+import { postToModal } from '@/lib/modal';
 
 export async function POST(request: NextRequest) {
   try {
     const body = await request.json();
-    const { files, language = 'python', entry_point = 'test' } = body;
+    const { files, language = 'python', entry_point = 'test', session_id, profile = false, flamegraph = false, benchmark_runs = 0 } = body;
 
     if (!files || typeof files !== 'object' || Object.keys(files).length === 0) {
       return NextResponse.json(
@@ -20,18 +21,16 @@ export async function POST(request: NextRequest) {
     }
 
     // Call Modal multi-file endpoint
-    const modalResponse = await fetch(
+    const modalResponse = await postToModal(
       `https://playground-hackmit--code-executor-execute-multi-file-endpoint.modal.run/`,
       {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          files,
-          language,
-          entry_point
-        }),
+        files,
+        language,
+        entry_point,
+        session_id,
+        profile,
+        flamegraph,
+        benchmark_runs
       }
     );
 
@@ -520,7 +520,8 @@ export function EditorProvider({ children }: { children: ReactNode }) {
           body: JSON.stringify({
             files: files,
             language: detectedLanguage,
-            entry_point: actualEntryPoint
+            entry_point: actualEntryPoint,
+            session_id: sessionId
           }),
         });
 
@@ -0,0 +1,26 @@
+import { gzipSync } from 'zlib';
+
+// Bodies smaller than this are not worth compressing
+const COMPRESSION_MIN_BYTES = 1024;
+
+// POST a JSON payload to a Modal endpoint, gzip-compressing large bodies.
+// Responses are requested gzip-compressed; fetch decompresses them transparently.
+export async function postToModal(url: string, payload: unknown): Promise<Response> {
+  const json = Buffer.from(JSON.stringify(payload));
+  const headers: Record<string, string> = {
+    'Content-Type': 'application/json',
+    'Accept-Encoding': 'gzip',
+  };
+
+  let body: Buffer = json;
+  if (json.length >= COMPRESSION_MIN_BYTES) {
+    body = gzipSync(json);
+    headers['Content-Encoding'] = 'gzip';
+  }
+
+  return fetch(url, {
+    method: 'POST',
+    headers,
+    body: new Uint8Array(body),
+  });
+}
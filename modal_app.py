@@ -1,12 +1,32 @@
 import modal
 import sys
 import io
+import gzip
+import zlib
+import cProfile
+import pstats
+import shutil
+import threading
+import gc
+import resource
+import statistics
+import json
+import ast
+import hashlib
+import copy
+import types
+import importlib.abc
+import importlib.machinery
+import re
+import uuid
 import traceback
 import subprocess
 import tempfile
 import os
+import time
+from collections import Counter, OrderedDict
 from contextlib import redirect_stdout, redirect_stderr
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 from pydantic import BaseModel
 
 # Create Modal app
@@ -30,26 +50,187 @@ image = modal.Image.debian_slim().pip_install([
 # Separate web image for endpoints
 web_image = modal.Image.debian_slim().pip_install([
     "fastapi[all]",
-    "anthropic"
+    "anthropic",
+    "msgpack",
+    "zstandard",
 ])
 
+with web_image.imports():
+    from fastapi import Request, Response
+
+# Shared metrics store. Each container writes a snapshot of its own counters
+# under its task ID, and the metrics endpoint sums the snapshots, so no two
+# containers ever write the same key. Live containers rewrite their key every
+# flush interval; compact_metrics folds keys that stopped updating (dead
+# containers) into one aggregate key, so the store stays bounded and the
+# summed counters never go down.
+metrics_store = modal.Dict.from_name("code-executor-metrics", create_if_missing=True)
+
+_CONTAINER_ID = os.getenv("MODAL_TASK_ID", f"local-{os.getpid()}")
+_METRICS_AGGREGATE_KEY = "__aggregate__"
+# Seconds without a flush after which a container is considered gone
+_METRICS_STALE_AFTER = 600
+
+# Histogram bucket upper bounds in seconds
+_LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+# Seconds between background publishes of this container's metrics
+_METRICS_FLUSH_INTERVAL = 15
+
+_metrics = {"counters": {}, "histograms": {}}
+_metrics_lock = threading.Lock()
+_metrics_flusher = None
+_warm_functions = set()
+
+def _language_label(language: str) -> str:
+    """Map a client-supplied language onto a fixed set of label values."""
+    language = language.lower()
+    if language == "python":
+        return "python"
+    if language in ["javascript", "js", "node"]:
+        return "javascript"
+    if language in ["bash", "shell", "sh"]:
+        return "bash"
+    return "other"
+
+def _model_label(model: str) -> str:
+    """Keep plausible Claude model names as label values, bucket everything else."""
+    return model if re.fullmatch(r"claude-[a-z0-9.-]{1,64}", model) else "other"
+
+def _escape_label_value(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_string(labels: Dict[str, str]) -> str:
+    """Render labels as a Prometheus label set, e.g. '{language="python"}'."""
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in sorted(labels.items()))
+    return "{" + pairs + "}"
+
+def _inc_counter(name: str, labels: Dict[str, str], value: float = 1) -> None:
+    key = (name, _label_string(labels))
+    with _metrics_lock:
+        _metrics["counters"][key] = _metrics["counters"].get(key, 0) + value
+
+def _observe_histogram(name: str, labels: Dict[str, str], value: float) -> None:
+    key = (name, _label_string(labels))
+    with _metrics_lock:
+        histogram = _metrics["histograms"].setdefault(key, {
+            "buckets": [0] * len(_LATENCY_BUCKETS),
+            "sum": 0.0,
+            "count": 0,
+        })
+        for i, bound in enumerate(_LATENCY_BUCKETS):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+def _record_container_start(function_name: str) -> None:
+    """Count the first call in this container as a cold start, the rest as warm."""
+    start = "warm" if function_name in _warm_functions else "cold"
+    _warm_functions.add(function_name)
+    _inc_counter("executor_container_starts_total", {"function": function_name, "start": start})
+
+def _record_queue_wait(function_name: str, enqueued_at: float = None) -> None:
+    if enqueued_at:
+        _observe_histogram("executor_queue_wait_seconds", {"function": function_name},
+                           max(time.time() - enqueued_at, 0.0))
+
+def _flush_metrics() -> None:
+    """Publish a copy of this container's metrics. Never fails the caller."""
+    with _metrics_lock:
+        snapshot = {
+            "counters": dict(_metrics["counters"]),
+            "histograms": {
+                key: {**histogram, "buckets": list(histogram["buckets"])}
+                for key, histogram in _metrics["histograms"].items()
+            },
+            "flushed_at": time.time(),
+        }
+    try:
+        metrics_store.put(_CONTAINER_ID, snapshot)
+    except Exception as e:
+        print(f"[DEBUG] Failed to flush metrics: {str(e)}")
+
+def _flush_metrics_periodically() -> None:
+    while True:
+        time.sleep(_METRICS_FLUSH_INTERVAL)
+        _flush_metrics()
+
+def _schedule_metrics_flush() -> None:
+    """
+    Make sure this container publishes its metrics in the background, so requests
+    never wait on the metrics store.
+    """
+    global _metrics_flusher
+    if _metrics_flusher is None:
+        _metrics_flusher = threading.Thread(target=_flush_metrics_periodically, daemon=True)
+        _metrics_flusher.start()
+
+def _merge_snapshots(snapshots) -> Dict[str, Any]:
+    """Sum metrics snapshots into one."""
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for key, value in snapshot.get("counters", {}).items():
+            counters[key] = counters.get(key, 0) + value
+        for key, histogram in snapshot.get("histograms", {}).items():
+            total = histograms.setdefault(key, {
+                "buckets": [0] * len(_LATENCY_BUCKETS),
+                "sum": 0.0,
+                "count": 0,
+            })
+            for i, count in enumerate(histogram["buckets"]):
+                total["buckets"][i] += count
+            total["sum"] += histogram["sum"]
+            total["count"] += histogram["count"]
+    return {"counters": counters, "histograms": histograms}
+
+def _render_metrics(snapshots) -> str:
+    """Sum per-container snapshots and render them in Prometheus text format."""
+    merged = _merge_snapshots(snapshots)
+    counters = merged["counters"]
+    histograms = merged["histograms"]
+
+    lines = []
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {name} counter")
+        for (series_name, labels), value in sorted(counters.items()):
+            if series_name == name:
+                lines.append(f"{name}{labels} {value}")
+
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {name} histogram")
+        for (series_name, labels), histogram in sorted(histograms.items()):
+            if series_name != name:
+                continue
+            inner = labels[1:-1] + "," if labels else ""
+            for bound, count in zip(_LATENCY_BUCKETS, histogram["buckets"]):
+                lines.append(f'{name}_bucket{{{inner}le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{inner}le="+Inf"}} {histogram["count"]}')
+            lines.append(f"{name}_sum{labels} {histogram['sum']}")
+            lines.append(f"{name}_count{labels} {histogram['count']}")
+
+    return "\n".join(lines) + "\n"
+
 @app.function(
     image=image,
     timeout=30,  # 30 second timeout
     memory=1024,  # 1GB memory limit
 )
-def execute_code(code: str, language: str = "python") -> Dict[str, Any]:
+def execute_code(code: str, language: str = "python", enqueued_at: float = None) -> Dict[str, Any]:
     """
     Execute single file code (legacy function for backward compatibility)
     """
-    return execute_multi_file({"main": code}, language, "test")
+    return execute_multi_file({"main": code}, language, "test", enqueued_at)
 
 @app.function(
     image=image,
     timeout=30,  # 30 second timeout
     memory=1024,  # 1GB memory limit
 )
-def execute_multi_file(files: Dict[str, str], language: str = "python", entry_point: str = "test") -> Dict[str, Any]:
+def execute_multi_file(files: Dict[str, str], language: str = "python", entry_point: str = "test", enqueued_at: float = None, session_id: Optional[str] = None, profile: bool = False, flamegraph: bool = False, benchmark_runs: int = 0) -> Dict[str, Any]:
     """
     Execute multi-file code with interdependencies in a sandboxed environment.
     
@@ -57,6 +238,19 @@ def execute_multi_file(files: Dict[str, str], language: str = "python", entry_po
         files: Dictionary mapping file names to their content
         language: Programming language (currently supports 'python', 'javascript', 'bash')
         entry_point: The main file to execute (key in files dict)
+        enqueued_at: Caller's time.time() when the call was made, used for queue wait metrics
+        session_id: Editor session ID. For Python, imported modules whose source and
+            transitive imports are unchanged since the session's last run in this
+            container are reused instead of re-executed
+        profile: Run the entry point under cProfile (Python) or --cpu-prof (JavaScript)
+            and return the hottest functions under "profile". Profiled runs are flagged
+            with "profiled" and must not be compared with plain runs
+        flamegraph: With profile, also return collapsed stacks for flamegraph tools
+        benchmark_runs: After a normal warm-up run, time up to this many further runs of
+            the entry point pinned to one CPU and return min/median/MAD under "benchmark",
+            normalized against a calibration workload run in the same container. Runs
+            that would overrun the time budget are skipped, and failures are reported
+            in "benchmark" without changing the warm-up result
     
     Returns:
         Dictionary with execution results including output, errors, and success status
@@ -65,9 +259,15 @@ def execute_multi_file(files: Dict[str, str], language: str = "python", entry_po
     print(f"[DEBUG] Language: {language}")
     print(f"[DEBUG] Entry point: {entry_point}")
     print(f"[DEBUG] Files: {list(files.keys())}")
+    print(f"[DEBUG] Session: {session_id}")
+    print(f"[DEBUG] Profile: {profile}")
+    print(f"[DEBUG] Benchmark runs: {benchmark_runs}")
     for filename, content in files.items():
         print(f"[DEBUG] File '{filename}': {content[:100]}...")
     
+    _record_container_start("execute_multi_file")
+    _record_queue_wait("execute_multi_file", enqueued_at)
+    
     result = {
         "success": False,
         "output": "",
@@ -76,32 +276,318 @@ def execute_multi_file(files: Dict[str, str], language: str = "python", entry_po
         "files_created": []
     }
     
+    mode = "profile" if profile else "benchmark" if benchmark_runs else "plain"
+    start_time = time.time()
     try:
-        import time
-        start_time = time.time()
+        if profile and benchmark_runs:
+            result["error"] = "Profiling and benchmarking cannot be combined"
+            return result
+        if not 0 <= benchmark_runs <= _MAX_BENCHMARK_RUNS:
+            result["error"] = f"benchmark_runs must be between 0 and {_MAX_BENCHMARK_RUNS}"
+            return result
         
         if language.lower() == "python":
-            result = _execute_python_multi_file(files, entry_point)
+            result = _execute_python_multi_file(files, entry_point, session_id, profile, flamegraph, benchmark_runs)
         elif language.lower() in ["javascript", "js", "node"]:
-            result = _execute_javascript_multi_file(files, entry_point)
+            result = _execute_javascript_multi_file(files, entry_point, profile, flamegraph, benchmark_runs)
         elif language.lower() in ["bash", "shell", "sh"]:
             result = _execute_bash_multi_file(files, entry_point)
+            if profile:
+                result["profile"] = {"error": "Profiling is not supported for bash"}
+            if benchmark_runs:
+                result["benchmark"] = {"error": "Benchmarking is not supported for bash"}
         else:
             result["error"] = f"Unsupported language: {language}"
             return result
             
         result["execution_time"] = time.time() - start_time
+        result["profiled"] = "top_functions" in result.get("profile", {})
         
     except Exception as e:
         result["error"] = f"Execution failed: {str(e)}"
         result["success"] = False
+    finally:
+        outcome = "success" if result.get("success") else "error"
+        _inc_counter("executor_requests_total", {"language": _language_label(language), "outcome": outcome})
+        _observe_histogram("executor_execution_duration_seconds",
+                           {"language": _language_label(language), "mode": mode},
+                           time.time() - start_time)
+        _schedule_metrics_flush()
     
     return result
 
-def _execute_python_multi_file(files: Dict[str, str], entry_point: str) -> Dict[str, Any]:
+def _build_safe_globals(file_path: str) -> Dict[str, Any]:
+    """Build the restricted globals used to run user Python code."""
+    safe_globals = {
+        "__builtins__": {
+            "print": print,
+            "len": len,
+            "range": range,
+            "str": str,
+            "int": int,
+            "float": float,
+            "list": list,
+            "dict": dict,
+            "tuple": tuple,
+            "set": set,
+            "bool": bool,
+            "abs": abs,
+            "max": max,
+            "min": min,
+            "sum": sum,
+            "sorted": sorted,
+            "enumerate": enumerate,
+            "zip": zip,
+            "map": map,
+            "filter": filter,
+            "type": type,
+            "isinstance": isinstance,
+            "hasattr": hasattr,
+            "getattr": getattr,
+            "setattr": setattr,
+            "dir": dir,
+            "help": help,
+            "__import__": __import__,
+            "input": lambda prompt="": "",
+            "open": open,
+            "ValueError": ValueError,
+            "TypeError": TypeError,
+            "KeyError": KeyError,
+            "IndexError": IndexError,
+            "AttributeError": AttributeError,
+            "NameError": NameError,
+            "ZeroDivisionError": ZeroDivisionError,
+            "FileNotFoundError": FileNotFoundError,
+            "Exception": Exception,
+            "BaseException": BaseException,
+        },
+        "__name__": "__main__",
+        "__file__": file_path
+    }
+    
+    # Allow common safe imports
+    safe_globals.update({
+        "math": __import__("math"),
+        "random": __import__("random"),
+        "json": __import__("json"),
+        "datetime": __import__("datetime"),
+        "time": __import__("time"),
+        "re": __import__("re"),
+        "os": __import__("os"),
+        "sys": __import__("sys"),
+    })
+    
+    # Try to import optional packages if available
+    try:
+        safe_globals["numpy"] = __import__("numpy")
+        safe_globals["np"] = __import__("numpy")
+    except ImportError:
+        pass
+        
+    try:
+        safe_globals["pandas"] = __import__("pandas")
+        safe_globals["pd"] = __import__("pandas")
+    except ImportError:
+        pass
+        
+    try:
+        safe_globals["matplotlib"] = __import__("matplotlib")
+        safe_globals["plt"] = __import__("matplotlib.pyplot")
+    except ImportError:
+        pass
+    
+    return safe_globals
+
+# Per-container cache of imported project modules, keyed by session ID.
+# Each session maps module name -> (fingerprint, module object, state snapshot,
+# approximate bytes). The snapshot is the module's top-level state right after its
+# own code ran, so a reused module starts each run exactly as a fresh import would.
+# A module is only cached or reused together with all the project modules it
+# transitively imports. State a module's top-level code writes into another
+# project module is not replayed.
+_MAX_MODULE_SESSIONS = 32
+_MAX_MODULE_CACHE_BYTES = 200 * 1024 * 1024
+_module_sessions = OrderedDict()
+
+def _is_dunder(name: str) -> bool:
+    return name.startswith("__") and name.endswith("__")
+
+def _snapshot_module_state(module: types.ModuleType, memo: Dict[int, Any]) -> Optional[Dict[str, Any]]:
+    """Deep-copy a module's top-level state, or return None if it cannot be copied."""
+    state = {key: value for key, value in vars(module).items() if not _is_dunder(key)}
+    # Imported modules are shared, not copied
+    for value in state.values():
+        if isinstance(value, types.ModuleType):
+            memo[id(value)] = value
+    try:
+        return copy.deepcopy(state, memo)
+    except Exception:
+        return None
+
+def _approximate_size(obj: Any) -> int:
+    """Rough deep size of an object graph in bytes, counting shared objects once."""
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, (types.ModuleType, type, types.FunctionType)):
+            continue
+        seen.add(id(current))
+        try:
+            total += sys.getsizeof(current)
+        except TypeError:
+            continue
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            stack.extend(current)
+        elif hasattr(current, "__dict__"):
+            stack.append(vars(current))
+    return total
+
+def _module_cache_bytes() -> int:
+    return sum(entry[3] for modules in _module_sessions.values() for entry in modules.values())
+
+def _store_module_session(session_id: str, modules: Dict[str, tuple]) -> None:
+    """Cache a session's modules, evicting the least recently used sessions to stay in budget."""
+    _module_sessions.pop(session_id, None)
+    if sum(entry[3] for entry in modules.values()) > _MAX_MODULE_CACHE_BYTES:
+        return
+    _module_sessions[session_id] = modules
+    while len(_module_sessions) > _MAX_MODULE_SESSIONS or _module_cache_bytes() > _MAX_MODULE_CACHE_BYTES:
+        _module_sessions.popitem(last=False)
+
+def _restore_module_states(modules: Dict[str, tuple]) -> None:
+    """Reset cached modules, in place, to fresh copies of their snapshots."""
+    memo = {}
+    for entry in modules.values():
+        for value in entry[2].values():
+            if isinstance(value, types.ModuleType):
+                memo[id(value)] = value
+    # Copy all snapshots together so objects shared between modules stay shared
+    states = copy.deepcopy({name: entry[2] for name, entry in modules.items()}, memo)
+    for name, entry in modules.items():
+        module = entry[1]
+        for key in [key for key in vars(module) if not _is_dunder(key)]:
+            del module.__dict__[key]
+        module.__dict__.update(states[name])
+
+class _SnapshotLoader(importlib.abc.Loader):
+    """Wraps a source loader to snapshot a module right after its top-level code runs."""
+
+    def __init__(self, loader, snapshots: Dict[str, Any], memo: Dict[int, Any]):
+        self.loader = loader
+        self.snapshots = snapshots
+        self.memo = memo
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.loader.exec_module(module)
+        self.snapshots[module.__name__] = (module, _snapshot_module_state(module, self.memo))
+
+    def get_source(self, fullname):
+        return self.loader.get_source(fullname)
+
+class _SnapshotFinder(importlib.abc.MetaPathFinder):
+    """Finds submitted modules in a run's temp directory and snapshots them as they load."""
+
+    def __init__(self, temp_dir: str, names: set, snapshots: Dict[str, Any]):
+        self.temp_dir = temp_dir
+        self.names = names
+        self.snapshots = snapshots
+        self.memo = {}
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname not in self.names:
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(fullname, [self.temp_dir])
+        if spec is not None and spec.loader is not None:
+            spec.loader = _SnapshotLoader(spec.loader, self.snapshots, self.memo)
+        return spec
+
+def _owns_module(module: types.ModuleType, temp_dir: str) -> bool:
+    """Whether a sys.modules entry belongs to the run using temp_dir."""
+    module_file = getattr(module, "__file__", None) or ""
+    return module_file.startswith(temp_dir + os.sep)
+
+def _unload_project_modules(project_modules: set, temp_dir: str) -> None:
+    """Remove this run's modules from sys.modules, leaving same-named stdlib modules alone."""
+    for name in project_modules:
+        module = sys.modules.get(name)
+        if module is not None and _owns_module(module, temp_dir):
+            del sys.modules[name]
+
+def _module_name(filename: str) -> str:
+    return filename[:-3] if filename.endswith('.py') else filename
+
+def _python_import_graph(files: Dict[str, str]) -> Dict[str, set]:
+    """Map each submitted module to the submitted modules it imports."""
+    sources = {_module_name(filename): content for filename, content in files.items()}
+    graph = {}
+    for name, content in sources.items():
+        imports = set()
+        try:
+            tree = ast.parse(content)
+        except SyntaxError:
+            # Let execution report the error; the module simply has no known edges
+            tree = None
+        for node in ast.walk(tree) if tree else []:
+            if isinstance(node, ast.Import):
+                imports.update(alias.name.split('.')[0] for alias in node.names)
+            elif isinstance(node, ast.ImportFrom):
+                if node.module:
+                    imports.add(node.module.split('.')[0])
+                else:
+                    # from . import helper
+                    imports.update(alias.name for alias in node.names)
+        graph[name] = {dep for dep in imports if dep in sources and dep != name}
+    return graph
+
+def _transitive_imports(name: str, graph: Dict[str, set]) -> set:
+    """The module itself plus every submitted module it imports, directly or not."""
+    inputs = set()
+    stack = [name]
+    while stack:
+        current = stack.pop()
+        if current not in inputs:
+            inputs.add(current)
+            stack.extend(graph.get(current, ()))
+    return inputs
+
+def _closed_under_imports(names: set, graph: Dict[str, set]) -> set:
+    """The names whose transitive project imports all lie within names."""
+    return {name for name in names if _transitive_imports(name, graph) <= names}
+
+def _module_fingerprints(files: Dict[str, str]) -> Dict[str, str]:
+    """Hash each module's source together with the sources of everything it transitively imports."""
+    sources = {_module_name(filename): content for filename, content in files.items()}
+    graph = _python_import_graph(files)
+    fingerprints = {}
+    for name in sources:
+        inputs = _transitive_imports(name, graph)
+        digest = hashlib.sha256()
+        for dep in sorted(inputs):
+            digest.update(dep.encode() + b"\0" + sources[dep].encode() + b"\0")
+        fingerprints[name] = digest.hexdigest()
+    return fingerprints
+
+def _execute_python_multi_file(files: Dict[str, str], entry_point: str, session_id: Optional[str] = None, profile: bool = False, flamegraph: bool = False, benchmark_runs: int = 0) -> Dict[str, Any]:
     """Execute Python code with multiple files and dependencies."""
     result = {"success": False, "output": "", "error": "", "files_created": []}
     
+    # Submitted modules other than the entry point, which is exec'd rather than imported
+    project_modules = {_module_name(filename) for filename in files} - {_module_name(entry_point)}
+    fingerprints = _module_fingerprints(files) if session_id else {}
+    import_graph = _python_import_graph(files) if session_id else {}
+    benchmark_deadline = time.monotonic() + _BENCHMARK_TIME_BUDGET
+    snapshots = {}
+    snapshot_finder = None
+    reused = {}
+    
     # Capture stdout and stderr
     old_stdout = sys.stdout
     old_stderr = sys.stderr
@@ -133,84 +619,32 @@ def _execute_python_multi_file(files: Dict[str, str], entry_point: str) -> Dict[
         # Add temp directory to Python path for imports
         sys.path.insert(0, temp_dir)
         
-        # Create a restricted globals environment
-        safe_globals = {
-            "__builtins__": {
-                "print": print,
-                "len": len,
-                "range": range,
-                "str": str,
-                "int": int,
-                "float": float,
-                "list": list,
-                "dict": dict,
-                "tuple": tuple,
-                "set": set,
-                "bool": bool,
-                "abs": abs,
-                "max": max,
-                "min": min,
-                "sum": sum,
-                "sorted": sorted,
-                "enumerate": enumerate,
-                "zip": zip,
-                "map": map,
-                "filter": filter,
-                "type": type,
-                "isinstance": isinstance,
-                "hasattr": hasattr,
-                "getattr": getattr,
-                "setattr": setattr,
-                "dir": dir,
-                "help": help,
-                "__import__": __import__,
-                "input": lambda prompt="": "",
-                "open": open,
-                "ValueError": ValueError,
-                "TypeError": TypeError,
-                "KeyError": KeyError,
-                "IndexError": IndexError,
-                "AttributeError": AttributeError,
-                "NameError": NameError,
-                "ZeroDivisionError": ZeroDivisionError,
-                "FileNotFoundError": FileNotFoundError,
-                "Exception": Exception,
-                "BaseException": BaseException,
-            },
-            "__name__": "__main__",
-            "__file__": os.path.join(temp_dir, f"{entry_point}.py")
+        # Restore the session's cached modules whose inputs have not changed.
+        # Names already in sys.modules (e.g. a file called json.py) are not ours to replace.
+        cached_modules = _module_sessions.get(session_id, {}) if session_id else {}
+        reusable = {
+            name for name, cached in cached_modules.items()
+            if name in project_modules and cached[0] == fingerprints[name] and name not in sys.modules
         }
+        # A reused module must not point at a stale copy of a dependency that reloads
+        reused = {name: cached_modules[name] for name in _closed_under_imports(reusable, import_graph)}
+        if reused:
+            _restore_module_states(reused)
+        for name, (_, module, _, _) in reused.items():
+            module.__file__ = os.path.join(temp_dir, f"{name}.py")
+            sys.modules[name] = module
+        if session_id:
+            for name in project_modules:
+                _inc_counter("executor_module_cache_total", {"result": "hit" if name in reused else "miss"})
+            result["reused_modules"] = sorted(reused)
+            # Snapshots deep-copy modules, which would show up in the user's profile,
+            # so profiled runs reuse the cache but do not add to it
+            if not profile:
+                snapshot_finder = _SnapshotFinder(temp_dir, project_modules, snapshots)
+                sys.meta_path.insert(0, snapshot_finder)
         
-        # Allow common safe imports
-        safe_globals.update({
-            "math": __import__("math"),
-            "random": __import__("random"),
-            "json": __import__("json"),
-            "datetime": __import__("datetime"),
-            "time": __import__("time"),
-            "re": __import__("re"),
-            "os": __import__("os"),
-            "sys": __import__("sys"),
-        })
-        
-        # Try to import optional packages if available
-        try:
-            safe_globals["numpy"] = __import__("numpy")
-            safe_globals["np"] = __import__("numpy")
-        except ImportError:
-            pass
-            
-        try:
-            safe_globals["pandas"] = __import__("pandas")
-            safe_globals["pd"] = __import__("pandas")
-        except ImportError:
-            pass
-            
-        try:
-            safe_globals["matplotlib"] = __import__("matplotlib")
-            safe_globals["plt"] = __import__("matplotlib.pyplot")
-        except ImportError:
-            pass
+        # Create a restricted globals environment
+        safe_globals = _build_safe_globals(os.path.join(temp_dir, f"{entry_point}.py"))
         
         # Execute the entry point file
         entry_file = entry_point if entry_point.endswith('.py') else f"{entry_point}.py"
@@ -223,8 +657,19 @@ def _execute_python_multi_file(files: Dict[str, str], entry_point: str) -> Dict[
         # Flatten builtins to make them directly accessible
         flattened_globals = safe_globals.copy()
         flattened_globals.update(safe_globals["__builtins__"])
+        # Untouched globals for each timed run, taken before the first run mutates them
+        benchmark_globals = flattened_globals.copy()
         
-        exec(entry_code, flattened_globals)
+        warmup_start = time.perf_counter_ns()
+        if profile:
+            profile_state = _start_python_profile(flamegraph, temp_dir)
+            try:
+                exec(entry_code, flattened_globals)
+            finally:
+                result["profile"] = _finish_python_profile(profile_state, temp_dir)
+        else:
+            exec(entry_code, flattened_globals)
+        warmup_ns = time.perf_counter_ns() - warmup_start
         
         result["output"] = stdout_capture.getvalue()
         error_output = stderr_capture.getvalue()
@@ -233,6 +678,23 @@ def _execute_python_multi_file(files: Dict[str, str], entry_point: str) -> Dict[
             result["error"] = error_output
         else:
             result["success"] = True
+        
+        # The run above was the warm-up; its output is the one reported
+        if benchmark_runs and result["success"]:
+            entry_code_object = compile(entry_code, "<string>", "exec")
+            # Snapshotting belongs to the warm-up; keep deep copies out of the timed runs
+            if snapshot_finder in sys.meta_path:
+                sys.meta_path.remove(snapshot_finder)
+            
+            def run_once(remaining):
+                # Re-import submitted modules so every run does the same work
+                _unload_project_modules(project_modules, temp_dir)
+                sys.stdout = io.StringIO()
+                sys.stderr = io.StringIO()
+                exec(entry_code_object, benchmark_globals.copy())
+            
+            result["benchmark"] = _run_benchmark(run_once, benchmark_runs, time.process_time_ns,
+                                                 benchmark_deadline, warmup_ns)
             
     except Exception as e:
         result["error"] = f"{type(e).__name__}: {str(e)}\n{traceback.format_exc()}"
@@ -255,9 +717,316 @@ def _execute_python_multi_file(files: Dict[str, str], entry_point: str) -> Dict[
         # Remove temp directory from Python path
         if temp_dir in sys.path:
             sys.path.remove(temp_dir)
+        
+        # Remember this session's imported modules, then unload them so other
+        # requests in this container cannot see them
+        if snapshot_finder in sys.meta_path:
+            sys.meta_path.remove(snapshot_finder)
+        if session_id:
+            # Cache the module objects that were snapshotted, not whatever later
+            # re-imports (e.g. benchmark runs) left in sys.modules
+            session_cache = {}
+            for name in project_modules:
+                if name in reused:
+                    session_cache[name] = reused[name]
+                elif name in snapshots and snapshots[name][1] is not None:
+                    module, snapshot = snapshots[name]
+                    # The live module roughly matches its snapshot in size
+                    size = 2 * _approximate_size(snapshot)
+                    session_cache[name] = (fingerprints[name], module, snapshot, size)
+            cacheable = _closed_under_imports(set(session_cache), import_graph)
+            _store_module_session(session_id, {name: session_cache[name] for name in cacheable})
+        _unload_project_modules(project_modules, temp_dir)
     
     return result
 
+_MAX_BENCHMARK_RUNS = 20
+# Seconds from the start of an execution by which benchmark runs must be done,
+# leaving headroom under the 30 second function timeout
+_BENCHMARK_TIME_BUDGET = 25
+
+def _children_cpu_time_ns() -> int:
+    """User plus system CPU time of finished child processes, in nanoseconds."""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return int((usage.ru_utime + usage.ru_stime) * 1e9)
+
+def _calibration_workload() -> int:
+    total = 0
+    for i in range(200000):
+        total = (total + i * i) % 1000003
+    return total
+
+def _pin_to_cpu():
+    """Pin this process to one CPU where supported. Returns (cpu, previous affinity)."""
+    if not hasattr(os, "sched_setaffinity"):
+        return None, None
+    try:
+        previous = os.sched_getaffinity(0)
+        cpu = min(previous)
+        os.sched_setaffinity(0, {cpu})
+        return cpu, previous
+    except OSError:
+        return None, None
+
+def _timing_summary(samples_ns: List[int]) -> Dict[str, float]:
+    """Min, median and median absolute deviation of timings, in seconds."""
+    median = statistics.median(samples_ns)
+    mad = statistics.median(abs(sample - median) for sample in samples_ns)
+    return {
+        "min": min(samples_ns) / 1e9,
+        "median": median / 1e9,
+        "mad": mad / 1e9,
+    }
+
+def _run_benchmark(run_once, runs: int, cpu_clock, deadline: float, warmup_ns: int) -> Dict[str, Any]:
+    """
+    Time run_once with perf_counter_ns and cpu_clock, pinned to one CPU.
+    
+    The calibration workload is timed on the same CPU first, so normalized_median
+    (median wall time / calibration median) is comparable across containers.
+    
+    Runs stop early when the next one, judged by the longest so far (starting from
+    the warm-up), would not finish before deadline (a time.monotonic() value).
+    run_once receives the seconds left. A failing run ends the benchmark and is
+    reported under "error"; it never affects the warm-up result.
+    """
+    summary = {"requested_runs": runs, "runs": 0, "warmup_runs": 1, "pinned_cpu": None}
+    calibration = []
+    wall_times = []
+    cpu_times = []
+    longest_ns = warmup_ns
+    
+    cpu, previous_affinity = _pin_to_cpu()
+    summary["pinned_cpu"] = cpu
+    # Keep objects the container already holds (e.g. cached session modules) out of
+    # garbage collection, so timings do not depend on what else lives in the process
+    gc.collect()
+    gc.freeze()
+    try:
+        for _ in range(5):
+            start = time.perf_counter_ns()
+            _calibration_workload()
+            calibration.append(time.perf_counter_ns() - start)
+        
+        for _ in range(runs):
+            remaining = deadline - time.monotonic()
+            if remaining * 1e9 < longest_ns:
+                summary["time_limited"] = True
+                break
+            gc.collect()
+            cpu_start = cpu_clock()
+            start = time.perf_counter_ns()
+            run_once(remaining)
+            wall_times.append(time.perf_counter_ns() - start)
+            cpu_times.append(cpu_clock() - cpu_start)
+            longest_ns = max(longest_ns, wall_times[-1])
+    except Exception as e:
+        summary["error"] = f"Benchmark run {len(wall_times) + 1} failed: {type(e).__name__}: {str(e)}"
+    finally:
+        gc.unfreeze()
+        if previous_affinity:
+            os.sched_setaffinity(0, previous_affinity)
+    
+    summary["runs"] = len(wall_times)
+    if "error" in summary:
+        return summary
+    if not wall_times:
+        summary["error"] = "No benchmark run fits in the time limit"
+        return summary
+    
+    wall_time = _timing_summary(wall_times)
+    calibration_time = statistics.median(calibration) / 1e9
+    summary.update({
+        "wall_time": wall_time,
+        "cpu_time": _timing_summary(cpu_times),
+        "calibration_time": calibration_time,
+        "normalized_median": wall_time["median"] / calibration_time,
+    })
+    return summary
+
+# Number of functions reported in a profile
+_PROFILE_TOP_N = 20
+# Interval between stack samples for collapsed stacks, in seconds
+_STACK_SAMPLE_INTERVAL = 0.005
+
+# cProfile entries for the built-ins the executor itself calls around user code
+_PROFILER_BUILTINS = {
+    "<built-in method builtins.exec>",
+    "<method 'disable' of '_lsprof.Profiler' objects>",
+}
+
+_cprofile_overhead_ratio = None
+
+def _measure_cprofile_overhead() -> float:
+    """Estimate how much cProfile slows down call-heavy code, measured once per container."""
+    global _cprofile_overhead_ratio
+    if _cprofile_overhead_ratio is None:
+        def step(x):
+            return x + 1
+        
+        def workload():
+            total = 0
+            for i in range(50000):
+                total = step(total)
+            return total
+        
+        start = time.perf_counter()
+        workload()
+        plain = time.perf_counter() - start
+        
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.runcall(workload)
+        profiled = time.perf_counter() - start
+        
+        _cprofile_overhead_ratio = round(profiled / plain, 2) if plain > 0 else None
+    return _cprofile_overhead_ratio
+
+def _relative_location(filename: str, lineno: int, root: str) -> str:
+    if filename == "~":
+        # cProfile's marker for built-in functions
+        return ""
+    if filename.startswith(root):
+        filename = os.path.relpath(filename, root)
+    return f"{filename}:{lineno}"
+
+def _sample_stacks(thread_id: int, stop: threading.Event, stacks: Counter, root: str) -> None:
+    """Sample the user code's call stack until stopped, counting collapsed stacks."""
+    while not stop.wait(_STACK_SAMPLE_INTERVAL):
+        frame = sys._current_frames().get(thread_id)
+        names = []
+        code = None
+        # Walk up to the executor frame that called exec()
+        while frame is not None and frame.f_code.co_filename != __file__:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({_relative_location(code.co_filename, code.co_firstlineno, root)})")
+            frame = frame.f_back
+        # Only keep samples taken inside the exec'd entry point
+        if code is not None and code.co_filename == "<string>":
+            stacks[";".join(reversed(names))] += 1
+
+def _start_python_profile(flamegraph: bool, root: str) -> Dict[str, Any]:
+    """Start cProfile, and a stack sampler when collapsed stacks were requested."""
+    state = {"profiler": cProfile.Profile(), "sampler": None}
+    if flamegraph:
+        state["stop"] = threading.Event()
+        state["stacks"] = Counter()
+        state["sampler"] = threading.Thread(
+            target=_sample_stacks,
+            args=(threading.get_ident(), state["stop"], state["stacks"], root),
+            daemon=True,
+        )
+        state["sampler"].start()
+    state["profiler"].enable()
+    return state
+
+def _finish_python_profile(state: Dict[str, Any], root: str) -> Dict[str, Any]:
+    """Stop profiling and summarize the hottest functions by self time."""
+    state["profiler"].disable()
+    if state["sampler"]:
+        state["stop"].set()
+        state["sampler"].join()
+    
+    # Drop the executor's own frames and the built-ins it uses to run and stop profiling
+    stats = {
+        (filename, lineno, name): entry
+        for (filename, lineno, name), entry in pstats.Stats(state["profiler"]).stats.items()
+        if filename != __file__ and name not in _PROFILER_BUILTINS
+    }
+    top_functions = []
+    for (filename, lineno, name), (_, ncalls, tottime, cumtime, _) in sorted(
+        stats.items(), key=lambda item: item[1][2], reverse=True
+    )[:_PROFILE_TOP_N]:
+        top_functions.append({
+            "function": name,
+            "location": _relative_location(filename, lineno, root),
+            "calls": ncalls,
+            "self_time": tottime,
+            "total_time": cumtime,
+        })
+    
+    profile = {
+        "profiler": "cProfile",
+        "overhead_ratio": _measure_cprofile_overhead(),
+        "top_functions": top_functions,
+    }
+    
+    if state["sampler"]:
+        profile["collapsed_stacks"] = "\n".join(
+            f"{stack} {count}" for stack, count in state["stacks"].most_common()
+        )
+    
+    return profile
+
+def _read_node_profile(profile_dir: str, root: str, flamegraph: bool) -> Dict[str, Any]:
+    """Summarize the V8 .cpuprofile written by node --cpu-prof."""
+    profiles = [name for name in os.listdir(profile_dir) if name.endswith(".cpuprofile")]
+    if not profiles:
+        return {"error": "Node.js did not write a CPU profile"}
+    
+    with open(os.path.join(profile_dir, profiles[0])) as f:
+        cpu_profile = json.load(f)
+    
+    nodes = {node["id"]: node for node in cpu_profile["nodes"]}
+    parents = {}
+    for node in cpu_profile["nodes"]:
+        for child in node.get("children", []):
+            parents[child] = node["id"]
+    
+    def frame(node):
+        call_frame = node["callFrame"]
+        name = call_frame["functionName"] or "(anonymous)"
+        if not call_frame["url"]:
+            return name, ""
+        filename = call_frame["url"].replace("file://", "")
+        return name, _relative_location(filename, call_frame["lineNumber"] + 1, root)
+    
+    # V8 bookkeeping nodes that are not user code
+    skipped = {"(root)", "(program)", "(idle)"}
+    self_time = Counter()
+    total_time = Counter()
+    stacks = Counter()
+    for node_id, delta in zip(cpu_profile.get("samples", []), cpu_profile.get("timeDeltas", [])):
+        path = []
+        while node_id is not None:
+            name, location = frame(nodes[node_id])
+            if name not in skipped:
+                path.append((name, location))
+            node_id = parents.get(node_id)
+        if not path:
+            continue
+        seconds = max(delta, 0) / 1e6
+        self_time[path[0]] += seconds
+        for key in set(path):
+            total_time[key] += seconds
+        stacks[";".join(
+            f"{name} ({location})" if location else name for name, location in reversed(path)
+        )] += 1
+    
+    top_functions = [
+        {
+            "function": name,
+            "location": location,
+            "calls": None,
+            "self_time": seconds,
+            "total_time": total_time[(name, location)],
+        }
+        for (name, location), seconds in self_time.most_common(_PROFILE_TOP_N)
+    ]
+    
+    profile = {
+        "profiler": "v8-cpu-prof",
+        # Sampling overhead is small but not measured
+        "overhead_ratio": None,
+        "top_functions": top_functions,
+    }
+    if flamegraph:
+        profile["collapsed_stacks"] = "\n".join(
+            f"{stack} {count}" for stack, count in stacks.most_common()
+        )
+    
+    return profile
+
 def _execute_python(code: str) -> Dict[str, Any]:
     """Execute Python code safely."""
     result = {"success": False, "output": "", "error": ""}
@@ -371,13 +1140,16 @@ def _execute_python(code: str) -> Dict[str, Any]:
     
     return result
 
-def _execute_javascript_multi_file(files: Dict[str, str], entry_point: str) -> Dict[str, Any]:
+def _execute_javascript_multi_file(files: Dict[str, str], entry_point: str, profile: bool = False, flamegraph: bool = False, benchmark_runs: int = 0) -> Dict[str, Any]:
     """Execute JavaScript code with multiple files and dependencies using Node.js."""
     result = {"success": False, "output": "", "error": "", "files_created": []}
     
     # Create temporary directory for files
     temp_dir = tempfile.mkdtemp()
     created_files = []
+    # Separate directory for V8 CPU profiles so file cleanup below is unchanged
+    profile_dir = tempfile.mkdtemp() if profile else None
+    benchmark_deadline = time.monotonic() + _BENCHMARK_TIME_BUDGET
     
     try:
         # Write all files to temporary directory
@@ -400,14 +1172,20 @@ def _execute_javascript_multi_file(files: Dict[str, str], entry_point: str) -> D
             result["error"] = f"Entry point '{entry_point}' not found in provided files"
             return result
         
+        command = ['node', entry_file]
+        if profile:
+            command = ['node', '--cpu-prof', f'--cpu-prof-dir={profile_dir}', entry_file]
+        
         # Execute using Node.js from the temp directory
+        warmup_start = time.perf_counter_ns()
         process = subprocess.run(
-            ['node', entry_file],
+            command,
             capture_output=True,
             text=True,
             timeout=25,  # 25 second timeout for subprocess
             cwd=temp_dir  # Run from temp directory to allow relative imports
         )
+        warmup_ns = time.perf_counter_ns() - warmup_start
         
         result["output"] = process.stdout
         if process.stderr:
@@ -418,6 +1196,19 @@ def _execute_javascript_multi_file(files: Dict[str, str], entry_point: str) -> D
         else:
             if not result["error"]:
                 result["error"] = f"Process exited with code {process.returncode}"
+        
+        if profile:
+            result["profile"] = _read_node_profile(profile_dir, temp_dir, flamegraph)
+        
+        # The run above was the warm-up; its output is the one reported
+        if benchmark_runs and result["success"]:
+            def run_once(remaining):
+                process = subprocess.run(command, capture_output=True, timeout=remaining, cwd=temp_dir)
+                if process.returncode != 0:
+                    raise RuntimeError(f"Benchmark run exited with code {process.returncode}")
+            
+            result["benchmark"] = _run_benchmark(run_once, benchmark_runs, _children_cpu_time_ns,
+                                                 benchmark_deadline, warmup_ns)
                 
     except subprocess.TimeoutExpired:
         result["error"] = "Code execution timed out"
@@ -436,6 +1227,8 @@ def _execute_javascript_multi_file(files: Dict[str, str], entry_point: str) -> D
             os.rmdir(temp_dir)
         except:
             pass
+        if profile_dir:
+            shutil.rmtree(profile_dir, ignore_errors=True)
     
     return result
 
@@ -630,6 +1423,8 @@ def call_claude_api(prompt: str, model: str = "claude-sonnet-4-20250514") -> Dic
         Dictionary with API response including content, success status, and any errors
     """
     import anthropic
+    _record_container_start("call_claude_api")
+    
     result = {
         "success": False,
         "content": "",
@@ -640,6 +1435,7 @@ def call_claude_api(prompt: str, model: str = "claude-sonnet-4-20250514") -> Dic
 
     CLAUDE_API_KEY = os.getenv("CLAUDE_API_KEY")
     
+    start_time = time.time()
     try:
         # Initialize the Anthropic client
         client = anthropic.Anthropic(api_key=CLAUDE_API_KEY)
@@ -672,13 +1468,188 @@ def call_claude_api(prompt: str, model: str = "claude-sonnet-4-20250514") -> Dic
             
     except Exception as e:
         result["error"] = f"Claude API call failed: {str(e)}"
+    finally:
+        outcome = "success" if result["success"] else "error"
+        model_label = _model_label(model)
+        _inc_counter("claude_requests_total", {"model": model_label, "outcome": outcome})
+        _observe_histogram("claude_request_duration_seconds", {"model": model_label}, time.time() - start_time)
+        for token_type in ("input", "output"):
+            tokens = result["usage"].get(f"{token_type}_tokens")
+            if tokens:
+                _inc_counter("claude_tokens_total", {"model": model_label, "type": token_type}, tokens)
+        _schedule_metrics_flush()
     
     return result
 
+@app.cls(
+    image=image,
+    timeout=30,  # 30 second timeout per step
+    memory=(1024, 2048),  # 1GB requested, killed above 2GB
+    scaledown_window=600,  # Sessions idle for 10 minutes are discarded
+    max_containers=1,  # One container per session ID, so state is never split
+)
+class ReplSession:
+    """
+    Stateful Python session. Each session ID gets its own warm container whose
+    namespace persists between steps, so a step only pays for its own code.
+    """
+    session_id: str = modal.parameter()
+
+    @modal.enter()
+    def start(self):
+        _record_container_start("repl_session")
+        namespace = _build_safe_globals("<repl>")
+        self.namespace = namespace.copy()
+        self.namespace.update(namespace["__builtins__"])
+        self.steps = 0
+
+    @modal.method()
+    def ping(self) -> Dict[str, Any]:
+        """Start the session container without running any code."""
+        return {"success": True, "session_id": self.session_id}
+
+    @modal.method()
+    def execute(self, code: str) -> Dict[str, Any]:
+        """
+        Execute a snippet against the session namespace.
+        
+        Like a notebook cell, the value of a trailing expression is echoed to the output.
+        
+        Returns:
+            Dictionary with execution results including output, errors, and success status.
+            new_session is True when the namespace was empty before this step, e.g. after
+            the session timed out and a fresh container was started.
+        """
+        result = {
+            "success": False,
+            "output": "",
+            "error": "",
+            "execution_time": 0,
+            "session_id": self.session_id,
+            "new_session": self.steps == 0,
+        }
+        self.steps += 1
+        
+        old_stdout = sys.stdout
+        old_stderr = sys.stderr
+        stdout_capture = io.StringIO()
+        stderr_capture = io.StringIO()
+        
+        start_time = time.time()
+        try:
+            sys.stdout = stdout_capture
+            sys.stderr = stderr_capture
+            
+            tree = ast.parse(code, mode="exec")
+            trailing_expr = None
+            if tree.body and isinstance(tree.body[-1], ast.Expr):
+                trailing_expr = ast.Expression(tree.body.pop().value)
+            
+            exec(compile(tree, "<repl>", "exec"), self.namespace)
+            if trailing_expr is not None:
+                value = eval(compile(trailing_expr, "<repl>", "eval"), self.namespace)
+                if value is not None:
+                    print(repr(value))
+            
+            result["output"] = stdout_capture.getvalue()
+            error_output = stderr_capture.getvalue()
+            
+            if error_output:
+                result["error"] = error_output
+            else:
+                result["success"] = True
+                
+        except Exception as e:
+            result["output"] = stdout_capture.getvalue()
+            result["error"] = f"{type(e).__name__}: {str(e)}\n{traceback.format_exc()}"
+        finally:
+            sys.stdout = old_stdout
+            sys.stderr = old_stderr
+            result["execution_time"] = time.time() - start_time
+            _inc_counter("repl_steps_total", {"outcome": "success" if result["success"] else "error"})
+            _observe_histogram("repl_step_duration_seconds", {}, result["execution_time"])
+            _schedule_metrics_flush()
+        
+        return result
+
+    @modal.method()
+    def close(self) -> Dict[str, Any]:
+        """Discard the session namespace and let the container shut down."""
+        import modal.experimental
+        
+        self.namespace = {}
+        self.steps = 0
+        modal.experimental.stop_fetching_inputs()
+        return {"success": True, "session_id": self.session_id}
+
+# Bodies smaller than this are not worth compressing
+_COMPRESSION_MIN_BYTES = 1024
+# Refuse request bodies that decompress beyond this size
+_MAX_BODY_BYTES = 50 * 1024 * 1024
+
+def _decode_body(raw: bytes, headers) -> Any:
+    """Decode a gzip/zstd compressed JSON or MessagePack request body."""
+    encoding = headers.get("content-encoding", "").lower()
+    if encoding == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        raw = decompressor.decompress(raw, _MAX_BODY_BYTES)
+        if decompressor.unconsumed_tail:
+            raise ValueError("Request body too large")
+    elif encoding == "zstd":
+        import zstandard
+        # Stream so a frame declaring a huge content size cannot force a huge allocation
+        with zstandard.ZstdDecompressor().stream_reader(raw) as reader:
+            raw = reader.read(_MAX_BODY_BYTES + 1)
+        if len(raw) > _MAX_BODY_BYTES:
+            raise ValueError("Request body too large")
+    elif encoding not in ("", "identity"):
+        raise ValueError(f"Unsupported Content-Encoding: {encoding}")
+    
+    if not raw:
+        return {}
+    if "msgpack" in headers.get("content-type", ""):
+        import msgpack
+        return msgpack.unpackb(raw, raw=False)
+    return json.loads(raw)
+
+def _encode_response(payload: Any, headers) -> "Response":
+    """
+    Encode a response as MessagePack when the client accepts it, JSON otherwise,
+    compressed with zstd or gzip when the client accepts it and the body is large.
+    """
+    if "msgpack" in headers.get("accept", ""):
+        import msgpack
+        body = msgpack.packb(payload, use_bin_type=True)
+        media_type = "application/msgpack"
+    else:
+        body = json.dumps(payload).encode()
+        media_type = "application/json"
+    
+    response_headers = {"Vary": "Accept, Accept-Encoding"}
+    accepted_encodings = {
+        token.split(";")[0].strip().lower()
+        for token in headers.get("accept-encoding", "").split(",")
+    }
+    if len(body) >= _COMPRESSION_MIN_BYTES:
+        if "zstd" in accepted_encodings:
+            import zstandard
+            body = zstandard.ZstdCompressor(level=3).compress(body)
+            response_headers["Content-Encoding"] = "zstd"
+        elif "gzip" in accepted_encodings:
+            body = gzip.compress(body, compresslevel=6)
+            response_headers["Content-Encoding"] = "gzip"
+    
+    return Response(content=body, media_type=media_type, headers=response_headers)
+
+# Pydantic model for single-file execution request
+class CodeRequest(BaseModel):
+    code: str = ""
+    language: str = "python"
+
 # Web endpoint for single-file execution (backward compatibility)
 @app.function(image=web_image)
 @modal.fastapi_endpoint(method="POST")
-async def execute_code_endpoint(code: str, language: str = "python"):
+async def execute_code_endpoint(request: "Request"):
     """
     Web endpoint to execute code via HTTP POST request.
     
@@ -687,24 +1658,37 @@ async def execute_code_endpoint(code: str, language: str = "python"):
         "code": "print('Hello, World!')",
         "language": "python"
     }
+    
+    The legacy code and language query parameters are still accepted.
     """
-    if not code:
-        return {"error": "No code provided", "success": False}
+    try:
+        payload = dict(request.query_params)
+        payload.update(_decode_body(await request.body(), request.headers))
+        body = CodeRequest(**payload)
+    except Exception as e:
+        return _encode_response({"error": f"Request parsing failed: {str(e)}", "success": False}, request.headers)
+    
+    if not body.code:
+        return _encode_response({"error": "No code provided", "success": False}, request.headers)
     
     # Execute the code
-    result = await execute_code.remote.aio(code, language)
-    return result
+    result = await execute_code.remote.aio(body.code, body.language, time.time())
+    return _encode_response(result, request.headers)
 
 # Pydantic model for multi-file execution request
 class MultiFileRequest(BaseModel):
     files: Dict[str, str]
     language: str = "python"
     entry_point: str = "test"
+    session_id: Optional[str] = None
+    profile: bool = False
+    flamegraph: bool = False
+    benchmark_runs: int = 0
 
 # Web endpoint for multi-file execution
 @app.function(image=web_image)
 @modal.fastapi_endpoint(method="POST")
-async def execute_multi_file_endpoint(request: MultiFileRequest):
+async def execute_multi_file_endpoint(request: "Request"):
     """
     Web endpoint to execute multi-file code via HTTP POST request.
     
@@ -715,35 +1699,165 @@ async def execute_multi_file_endpoint(request: MultiFileRequest):
             "utils": "def helper():\n    return 'Hello from utils!'"
         },
         "language": "python",
-        "entry_point": "test"
+        "entry_point": "test",
+        "session_id": "optional editor session ID for module reuse",
+        "profile": false,
+        "flamegraph": false,
+        "benchmark_runs": 0
     }
+    
+    The body may also be MessagePack (Content-Type: application/msgpack) and
+    gzip or zstd compressed (Content-Encoding).
     """
     try:
-        print(f"[DEBUG] Multi-file execution request received:")
-        print(f"[DEBUG] Language: {request.language}")
-        print(f"[DEBUG] Entry point: {request.entry_point}")
-        print(f"[DEBUG] Number of files: {len(request.files)}")
-        print(f"[DEBUG] File names: {list(request.files.keys())}")
+        body = MultiFileRequest(**_decode_body(await request.body(), request.headers))
         
-        for filename, content in request.files.items():
-            print(f"[DEBUG] File '{filename}' content ({len(content)} chars):")
-            print(f"[DEBUG] Content preview: {content[:200]}...")
+        print(f"[DEBUG] Multi-file execution request received:")
+        print(f"[DEBUG] Language: {body.language}")
+        print(f"[DEBUG] Entry point: {body.entry_point}")
+        print(f"[DEBUG] Files: {[(filename, len(content)) for filename, content in body.files.items()]}")
         
-        if not request.files:
-            return {"error": "No files provided", "success": False}
+        if not body.files:
+            return _encode_response({"error": "No files provided", "success": False}, request.headers)
         
-        if request.entry_point not in request.files:
-            return {"error": f"Entry point '{request.entry_point}' not found in provided files", "success": False}
+        if body.entry_point not in body.files:
+            return _encode_response({"error": f"Entry point '{body.entry_point}' not found in provided files", "success": False}, request.headers)
         
         # Execute the multi-file code
-        print(f"[DEBUG] Calling execute_multi_file with files: {list(request.files.keys())}, language: {request.language}, entry_point: {request.entry_point}")
-        result = await execute_multi_file.remote.aio(request.files, request.language, request.entry_point)
-        print(f"[DEBUG] Execution result: {result}")
-        return result
+        result = await execute_multi_file.remote.aio(body.files, body.language, body.entry_point, time.time(), body.session_id, body.profile, body.flamegraph, body.benchmark_runs)
+        print(f"[DEBUG] Execution result: success={result.get('success')}, output={len(result.get('output', ''))} chars, error={len(result.get('error', ''))} chars")
+        return _encode_response(result, request.headers)
         
     except Exception as e:
         print(f"[DEBUG] Exception in execute_multi_file_endpoint: {str(e)}")
-        return {"error": f"Request parsing failed: {str(e)}", "success": False}
+        return _encode_response({"error": f"Request parsing failed: {str(e)}", "success": False}, request.headers)
+
+# Pydantic model for batch execution request
+class BatchRequest(BaseModel):
+    runs: List[MultiFileRequest]
+
+_MAX_BATCH_RUNS = 50
+
+# Web endpoint for batch multi-file execution
+@app.function(image=web_image)
+@modal.fastapi_endpoint(method="POST")
+async def execute_batch_endpoint(request: "Request"):
+    """
+    Web endpoint to execute several multi-file runs in parallel.
+    
+    Expected payload (JSON, or MessagePack with Content-Type: application/msgpack):
+    {
+        "runs": [
+            {"files": {...}, "language": "python", "entry_point": "test"},
+            ...
+        ]
+    }
+    
+    Returns results in the same order as the runs. Send Accept: application/msgpack
+    to receive MessagePack.
+    """
+    try:
+        body = BatchRequest(**_decode_body(await request.body(), request.headers))
+        
+        if not body.runs:
+            return _encode_response({"error": "No runs provided", "success": False}, request.headers)
+        
+        if len(body.runs) > _MAX_BATCH_RUNS:
+            return _encode_response({"error": f"At most {_MAX_BATCH_RUNS} runs per batch", "success": False}, request.headers)
+        
+        # Invalid runs get their error in place; the rest execute in parallel
+        results = [None] * len(body.runs)
+        valid_indices = []
+        for i, run in enumerate(body.runs):
+            if not run.files:
+                results[i] = {"error": "No files provided", "success": False}
+            elif run.entry_point not in run.files:
+                results[i] = {"error": f"Entry point '{run.entry_point}' not found in provided files", "success": False}
+            else:
+                valid_indices.append(i)
+        
+        enqueued_at = time.time()
+        args = [
+            (run.files, run.language, run.entry_point, enqueued_at, run.session_id, run.profile, run.flamegraph, run.benchmark_runs)
+            for run in (body.runs[i] for i in valid_indices)
+        ]
+        # One run timing out or losing its container must not fail the whole batch
+        outcomes = [outcome async for outcome in execute_multi_file.starmap.aio(args, return_exceptions=True)]
+        for i, outcome in zip(valid_indices, outcomes):
+            if isinstance(outcome, BaseException):
+                outcome = {"error": f"Execution failed: {type(outcome).__name__}: {str(outcome)}", "success": False}
+            results[i] = outcome
+        
+        return _encode_response({"success": True, "results": results}, request.headers)
+        
+    except Exception as e:
+        print(f"[DEBUG] Exception in execute_batch_endpoint: {str(e)}")
+        return _encode_response({"error": f"Batch execution failed: {str(e)}", "success": False}, request.headers)
+
+# Pydantic models for REPL session requests
+class SessionExecuteRequest(BaseModel):
+    session_id: str
+    code: str
+
+class SessionCloseRequest(BaseModel):
+    session_id: str
+
+# Web endpoint to create a REPL session
+@app.function(image=web_image)
+@modal.fastapi_endpoint(method="POST")
+async def create_session_endpoint():
+    """
+    Web endpoint to create a stateful Python session and warm its container.
+    
+    Returns:
+    {
+        "success": true,
+        "session_id": "..."
+    }
+    """
+    session_id = uuid.uuid4().hex
+    try:
+        return await ReplSession(session_id=session_id).ping.remote.aio()
+    except Exception as e:
+        return {"error": f"Session creation failed: {str(e)}", "success": False}
+
+# Web endpoint to execute a snippet in a REPL session
+@app.function(image=web_image)
+@modal.fastapi_endpoint(method="POST")
+async def execute_session_endpoint(request: SessionExecuteRequest):
+    """
+    Web endpoint to execute code against a session's persistent namespace.
+    
+    Expected JSON payload:
+    {
+        "session_id": "...",
+        "code": "df = pd.read_csv('data.csv')\ndf.head()"
+    }
+    """
+    if not request.code:
+        return {"error": "No code provided", "success": False}
+    
+    try:
+        return await ReplSession(session_id=request.session_id).execute.remote.aio(request.code)
+    except Exception as e:
+        return {"error": f"Session execution failed: {str(e)}", "success": False}
+
+# Web endpoint to close a REPL session
+@app.function(image=web_image)
+@modal.fastapi_endpoint(method="POST")
+async def close_session_endpoint(request: SessionCloseRequest):
+    """
+    Web endpoint to close a session and release its container.
+    
+    Expected JSON payload:
+    {
+        "session_id": "..."
+    }
+    """
+    try:
+        return await ReplSession(session_id=request.session_id).close.remote.aio()
+    except Exception as e:
+        return {"error": f"Session close failed: {str(e)}", "success": False}
 
 # Web endpoint for Claude API calls
 @app.function(image=web_image)
@@ -765,6 +1879,40 @@ async def claude_api_endpoint(prompt: str, model: str = "claude-sonnet-4-2025051
     result = await call_claude_api.remote.aio(prompt, model)
     return result
 
+# Web endpoint exposing metrics in Prometheus text format
+@app.function(image=web_image)
+@modal.fastapi_endpoint(method="GET")
+async def metrics_endpoint():
+    """
+    Web endpoint returning request, latency, container start and Claude usage
+    metrics aggregated across all containers, for scraping by Prometheus.
+    """
+    from fastapi.responses import PlainTextResponse
+    
+    snapshots = [snapshot async for _, snapshot in metrics_store.items.aio()]
+    return PlainTextResponse(_render_metrics(snapshots), media_type="text/plain; version=0.0.4")
+
+# Scheduled job keeping the metrics store bounded
+@app.function(image=web_image, schedule=modal.Period(minutes=5))
+def compact_metrics():
+    """
+    Fold snapshots of containers that stopped flushing into the aggregate key.
+    
+    The aggregate is written before the stale keys are deleted, so an interrupted
+    run can only leave counters briefly high, never lower. It is rewritten on
+    every run so it is never left idle in the store.
+    """
+    now = time.time()
+    aggregate = metrics_store.get(_METRICS_AGGREGATE_KEY, {})
+    stale = {
+        key: snapshot for key, snapshot in metrics_store.items()
+        if key != _METRICS_AGGREGATE_KEY and now - snapshot.get("flushed_at", 0) > _METRICS_STALE_AFTER
+    }
+    metrics_store.put(_METRICS_AGGREGATE_KEY, _merge_snapshots([aggregate, *stale.values()]))
+    for key in stale:
+        metrics_store.pop(key)
+    print(f"[DEBUG] Folded {len(stale)} stale container metrics snapshots")
+
 if __name__ == "__main__":
     # For local testing
     '''
@@ -778,6 +1926,16 @@ for i in range(3):
     result = execute_code.local(test_code, "python")
     print("Test result:", result)
     '''
+    # Profiling with a session must report only user code, not module snapshotting
+    profile_files = {
+        "test": "import helper\nprint(len(helper.data))",
+        "helper": "data = [[i] for i in range(100000)]",
+    }
+    result = execute_multi_file.local(profile_files, "python", "test", session_id="local-test", profile=True)
+    locations = [entry["location"] for entry in result["profile"]["top_functions"]]
+    assert not any(os.path.isabs(location.split(":")[0]) for location in locations), locations
+    print("Profile with session:", result["profile"]["top_functions"][:3])
+    
     test_prompt = "Tell me a story about a dog."
     result = call_claude_api.local(test_prompt)
     print("Test result:", result)